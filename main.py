@@ -1,26 +1,34 @@
+import asyncio
 import base64
+import functools
+import gzip
 import hashlib
 import hmac
-import html
-import json
+import ipaddress
 import logging
+import os
+import re
+import tempfile
 import time
 import uuid
-from datetime import datetime
-from typing import Optional, Dict
+from contextlib import asynccontextmanager, suppress
+from dataclasses import dataclass, field
+from typing import BinaryIO, Optional, Dict, List, Set, Tuple
 from urllib.parse import quote
-
-import requests
-from fastapi import FastAPI, Query, HTTPException
-from fastapi.responses import Response
+from urllib.request import getproxies
+
+import diskcache
+import httpx
+import orjson
+from fastapi import FastAPI, Header, Query, HTTPException
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, Field, field_validator
 from tenacity import (
     retry,
-    wait_exponential,
+    wait_random_exponential,
     stop_after_attempt,
-    retry_if_exception_type,
+    retry_if_exception,
 )
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
 
 # ================== 日志配置 ==================
 logging.basicConfig(level=logging.INFO)
@@ -42,6 +50,44 @@ DEFAULT_RATE = "0"
 DEFAULT_PITCH = "0"
 DEFAULT_OUTPUT_FORMAT = "audio-16khz-32kbitrate-mono-mp3"
 DEFAULT_STYLE = "general"
+# endpoint 请求的固定头，每次请求只需补上 X-MT-Signature
+ENDPOINT_HEADERS = {
+    "Accept-Language": "zh-Hans",
+    "X-ClientVersion": CLIENT_VERSION,
+    "X-UserId": USER_ID,
+    "X-HomeGeographicRegion": HOME_GEOGRAPHIC_REGION,
+    "X-ClientTraceId": CLIENT_TRACE_ID,
+    "User-Agent": USER_AGENT,
+    "Content-Type": "application/json; charset=utf-8",
+    "Content-Length": "0",
+    "Accept-Encoding": "gzip",
+}
+VOICES_HEADERS = {
+    "User-Agent": (
+        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
+        "AppleWebKit/537.36 (KHTML, like Gecko) "
+        "Chrome/107.0.0.0 Safari/537.36 Edg/107.0.1418.26"
+    ),
+    "X-Ms-Useragent": "SpeechStudio/2021.05.001",
+    "Content-Type": "application/json",
+    "Origin": "https://azure.microsoft.com",
+    "Referer": "https://azure.microsoft.com",
+}
+# 语音列表缓存有效期（秒），后台按此间隔重新拉取，以便发现新增语音
+VOICE_LIST_TTL_SEC = 3600
+# 合成结果的磁盘缓存：相同 SSML + 输出格式的音频是确定的，按 LRU 淘汰
+# 默认放在工作目录下（任何用户都可写），Docker 部署通过 TTS_CACHE_DIR 指向持久化卷
+AUDIO_CACHE_DIR = os.environ.get("TTS_CACHE_DIR", ".cache/tts")
+AUDIO_CACHE_SIZE_LIMIT = 2 ** 30  # 1 GiB
+# 批量合成：单次最多条目数，以及同时发往上游的最大请求数
+BATCH_MAX_ITEMS = 64
+BATCH_CONCURRENCY = 16
+# 启动预热（建连 + 拿 token）的最长等待时间，超时不影响启动
+WARMUP_TIMEOUT_SEC = 10
+# 超过该长度的文本不缓存 SSML
+SSML_CACHE_MAX_TEXT_LEN = 512
+# 上游返回这些状态码时视为临时故障，允许重试
+RETRY_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
 
 # 如果有代理，在这里统一配置；没有就设为 None
 GLOBAL_PROXIES: Optional[Dict[str, str]] = None
@@ -51,91 +97,254 @@ GLOBAL_PROXIES: Optional[Dict[str, str]] = None
 # }
 
 # ================== 全局状态 ==================
-endpoint: Optional[dict] = None
-expired_at: Optional[int] = None
-voice_list_cache = None
-
-app = FastAPI(title="TTS API", description="GET /tts 进行语音合成", version="1.0.0")
+@dataclass(frozen=True)
+class TokenState:
+    """一次 endpoint 刷新得到的 token 信息，整体替换，读取时无需加锁"""
+    region: str  # endpoint["r"]
+    exp: int     # JWT 中的过期时间戳
+    tts_url: str
+    # 默认输出格式下的完整请求头（含 Authorization: endpoint["t"]），只读，请求时直接复用
+    headers: Dict[str, str] = field(compare=False)
+
+
+token_state: Optional[TokenState] = None
+# 同一时刻只允许一个协程刷新 token，其余等待后直接复用结果
+_token_lock = asyncio.Lock()
+
+
+@dataclass(frozen=True)
+class VoiceCache:
+    """语音列表缓存；响应体在拉取时就序列化/压缩好，请求时直接返回"""
+    etag: str       # 未压缩表示的强 ETag
+    gzip_etag: str  # gzip 表示的强 ETag，两种表示内容不同，ETag 也必须不同
+    body: bytes
+    gzip_body: bytes
+
+
+voice_list_cache: Optional[VoiceCache] = None
+# 限制批量接口同时发往上游的请求数
+_batch_semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+audio_cache = diskcache.Cache(
+    AUDIO_CACHE_DIR,
+    size_limit=AUDIO_CACHE_SIZE_LIMIT,
+    eviction_policy="least-recently-used",
+)
+# 正在进行的语音列表拉取；并发调用方等待同一个任务，成功失败都共享结果
+_voice_refresh_task: Optional[asyncio.Task] = None
 
 
 # ================== Session 管理（核心优化） ==================
-def create_session(max_retries: int = 5) -> requests.Session:
+def get_proxy_mounts() -> Dict[str, Optional[str]]:
     """
-    创建带重试和连接池的 Session，专门给 TTS / endpoint / voices 用。
-    解决偶发 SSLEOFError / 连接中断问题。
+    返回 {URL 匹配模式: 代理地址}，代理地址为 None 表示直连。
+    优先使用 GLOBAL_PROXIES；未配置时沿用环境变量 HTTP(S)_PROXY / ALL_PROXY / NO_PROXY。
     """
-    session = requests.Session()
-
-    retry_cfg = Retry(
-        total=max_retries,
-        read=max_retries,
-        connect=max_retries,
-        backoff_factor=0.5,  # 0.5, 1, 2, 4, ...
-        status_forcelist=[429, 500, 502, 503, 504],
-        allowed_methods=["HEAD", "GET", "OPTIONS", "POST"],
-        raise_on_status=False,
-        respect_retry_after_header=True,
-    )
-
-    adapter = HTTPAdapter(
-        max_retries=retry_cfg,
-        pool_connections=20,
-        pool_maxsize=50,
-    )
+    if GLOBAL_PROXIES is not None:
+        return {f"{scheme}://": proxy_url for scheme, proxy_url in GLOBAL_PROXIES.items()}
+
+    env_proxies = getproxies()
+    no_proxy = env_proxies.pop("no", "")
+    mounts: Dict[str, Optional[str]] = {
+        f"{scheme}://": proxy_url
+        for scheme, proxy_url in env_proxies.items()
+        if scheme in ("http", "https", "all")
+    }
+    if not mounts:
+        return {}
+
+    for host in (h.strip() for h in no_proxy.split(",")):
+        if not host:
+            continue
+        if host == "*":
+            return {}
+        if "://" in host:
+            mounts[host] = None
+            continue
+        host = host.lstrip(".")
+        try:
+            ip = ipaddress.ip_address(host)
+            mounts[f"all://[{host}]" if ip.version == 6 else f"all://{host}"] = None
+        except ValueError:
+            # 域名同时匹配自身和子域名
+            mounts[f"all://{host}" if host.lower() == "localhost" else f"all://*{host}"] = None
+    return mounts
+
+
+def create_session(max_retries: int = 5) -> httpx.AsyncClient:
+    """
+    创建带连接池的 AsyncClient（开启 HTTP/2），专门给 TTS / endpoint / voices 用。
+    连接池满时请求会排队等待空闲连接，而不是临时新建连接。
+    传输层只对建连失败重试；状态码和读写中断由 tenacity 负责重试。
+    """
+    def make_transport(proxy: Optional[str] = None) -> httpx.AsyncHTTPTransport:
+        return httpx.AsyncHTTPTransport(
+            http2=True,
+            # httpx 默认空闲 5 秒就断开，调长以便突发请求间隔稍长时仍能复用 TLS 连接
+            limits=httpx.Limits(
+                max_connections=100,
+                max_keepalive_connections=50,
+                keepalive_expiry=60.0,
+            ),
+            retries=max_retries,
+            proxy=proxy,
+        )
 
-    session.mount("https://", adapter)
-    session.mount("http://", adapter)
+    # httpx 不支持按请求传代理，只能在创建 client 时挂载；
+    # 传入自定义 transport 后 httpx 不再读取代理环境变量，因此由 get_proxy_mounts 处理
+    default_transport = make_transport()
+    mounts = {
+        pattern: make_transport(proxy_url) if proxy_url else default_transport
+        for pattern, proxy_url in get_proxy_mounts().items()
+    }
 
-    return session
+    return httpx.AsyncClient(transport=default_transport, mounts=mounts or None)
 
 
 class SessionManager:
     """
-    管理带重试的 Session，并定期重建，避免复用“老掉线连接”。
+    管理共享的 AsyncClient，并定期重建，避免复用“老掉线连接”。
+    旧 client 上可能还有进行中的请求，因此延迟一段时间后再关闭。
+    session 只在事件循环线程中访问，且检查与重建之间没有 await，无需加锁；
+    调用方在函数开头取一次 session 后复用即可。
     """
 
-    def __init__(self, recreate_interval_sec: int = 600):
+    def __init__(self, recreate_interval_sec: int = 600, close_grace_sec: int = 60):
         self._session = create_session()
-        self._last_created = time.time()
+        self._last_created = time.monotonic()
         self._recreate_interval = recreate_interval_sec
+        self._close_grace = close_grace_sec
+        self._retired: Set[httpx.AsyncClient] = set()
+        self._close_tasks: Set[asyncio.Task] = set()
 
     @property
-    def session(self) -> requests.Session:
-        now = time.time()
-        if now - self._last_created > self._recreate_interval:
+    def session(self) -> httpx.AsyncClient:
+        now = time.monotonic()
+        if now - self._last_created <= self._recreate_interval:
+            return self._session
+
+        old_session = self._session
+        self._session = create_session()
+        self._last_created = now
+        self._retired.add(old_session)
+        task = asyncio.get_running_loop().create_task(self._close_later(old_session))
+        self._close_tasks.add(task)
+        task.add_done_callback(self._close_tasks.discard)
+        logger.info("重建 httpx AsyncClient，避免复用过期连接")
+        return self._session
+
+    async def _close_later(self, session: httpx.AsyncClient) -> None:
+        await asyncio.sleep(self._close_grace)
+        self._retired.discard(session)
+        try:
+            await session.aclose()
+        except Exception:
+            pass
+
+    async def aclose(self) -> None:
+        """关闭当前及所有待关闭的 client（应用退出时调用）"""
+        for task in list(self._close_tasks):
+            task.cancel()
+        for session in (self._session, *self._retired):
             try:
-                self._session.close()
+                await session.aclose()
             except Exception:
                 pass
-            self._session = create_session()
-            self._last_created = now
-            logger.info("重建 requests Session，避免复用过期连接")
-        return self._session
+        self._retired.clear()
 
 
 session_manager = SessionManager()
 
 
+async def warm_up() -> None:
+    """预先获取 token 并与各上游建立连接，避免首个请求承担 TLS 握手的延迟"""
+    token = await get_token_state()
+    session = session_manager.session
+    urls = (
+        f"https://{token.region}.tts.speech.microsoft.com/",
+        VOICES_LIST_URL,
+    )
+    # 只为建立连接，响应状态码无所谓
+    await asyncio.gather(*(session.head(url, timeout=5.0) for url in urls))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    try:
+        await asyncio.wait_for(warm_up(), timeout=WARMUP_TIMEOUT_SEC)
+    except Exception:
+        logger.warning("启动预热失败，首个请求将自行建立连接", exc_info=True)
+    voices_task = asyncio.create_task(_refresh_voices_loop())
+    yield
+    # 被 shield 保护的拉取任务不会随 voices_task 一起取消，需单独取消，
+    # 否则它会在 client 关闭后继续发请求并报错
+    for task in (voices_task, _voice_refresh_task):
+        if task is not None:
+            task.cancel()
+            with suppress(asyncio.CancelledError):
+                await task
+    await session_manager.aclose()
+    audio_cache.close()
+
+
+app = FastAPI(
+    title="TTS API",
+    description="GET /tts 进行语音合成",
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
+)
+
+
 # ================== 签名 & SSML ==================
+# 密钥解码和 HMAC 密钥初始化只做一次，每次签名 copy 模板即可
+_HMAC_TEMPLATE = hmac.new(base64.b64decode(VOICE_DECODE_KEY), digestmod=hashlib.sha256)
+
+
+# RFC 1123 日期中的星期/月份缩写（已小写），避免 strftime 的 locale 依赖
+_WEEKDAYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+_MONTHS = ("jan", "feb", "mar", "apr", "may", "jun",
+           "jul", "aug", "sep", "oct", "nov", "dec")
+
+
+@functools.lru_cache(maxsize=8)
+def _sign_prefix(url_str: str) -> bytes:
+    """待签名内容中与请求无关的前缀（已小写）"""
+    encoded_url = quote(url_str.split("://")[1], safe='')
+    return f"MSTranslatorAndroidApp{encoded_url}".lower().encode('utf-8')
+
+
 def sign(url_str: str) -> str:
-    u = url_str.split("://")[1]
-    encoded_url = quote(u, safe='')
-    uuid_str = str(uuid.uuid4()).replace("-", "")
-    formatted_date = datetime.utcnow().strftime(
-        "%a, %d %b %Y %H:%M:%S").lower() + "gmt"
-    bytes_to_sign = f"MSTranslatorAndroidApp{encoded_url}{formatted_date}{uuid_str}".lower().encode('utf-8')
-
-    decode = base64.b64decode(VOICE_DECODE_KEY)
-    hmac_sha256 = hmac.new(decode, bytes_to_sign, hashlib.sha256)
+    uuid_str = uuid.uuid4().hex
+    t = time.gmtime()
+    formatted_date = (
+        f"{_WEEKDAYS[t.tm_wday]}, {t.tm_mday:02d} {_MONTHS[t.tm_mon - 1]} {t.tm_year} "
+        f"{t.tm_hour:02d}:{t.tm_min:02d}:{t.tm_sec:02d}gmt"
+    )
+
+    # formatted_date 和 uuid_str 本身已是小写，无需整体再 lower()
+    hmac_sha256 = _HMAC_TEMPLATE.copy()
+    hmac_sha256.update(_sign_prefix(url_str))
+    hmac_sha256.update(formatted_date.encode('utf-8'))
+    hmac_sha256.update(uuid_str.encode('utf-8'))
     secret_key = hmac_sha256.digest()
     sign_base64 = base64.b64encode(secret_key).decode()
 
     return f"MSTranslatorAndroidApp::{sign_base64}::{formatted_date}::{uuid_str}"
 
 
-def get_ssml(text: str, voice_name: str, rate: str, pitch: str, style: str) -> str:
+# 与 html.escape(quote=True) 等价，单次扫描完成转义
+_SSML_ESCAPE = str.maketrans({
+    "&": "&amp;",
+    "<": "&lt;",
+    ">": "&gt;",
+    '"': "&quot;",
+    "'": "&#x27;",
+})
+
+
+def _build_ssml_bytes(text: str, voice_name: str, rate: str, pitch: str, style: str) -> bytes:
     # 简单转义文本，避免 SSML 注入
-    safe_text = html.escape(text)
+    safe_text = text.translate(_SSML_ESCAPE)
     return f"""
 <speak xmlns="http://www.w3.org/2001/10/synthesis" xmlns:mstts="http://www.w3.org/2001/mstts" version="1.0" xml:lang="zh-CN">
   <voice name="{voice_name}">
@@ -146,163 +355,362 @@ def get_ssml(text: str, voice_name: str, rate: str, pitch: str, style: str) -> s
     </mstts:express-as>
   </voice>
 </speak>
-""".strip()
+""".strip().encode("utf-8")
+
+
+_cached_ssml_bytes = functools.lru_cache(maxsize=1024)(_build_ssml_bytes)
+
+
+def get_ssml(text: str, voice_name: str, rate: str, pitch: str, style: str) -> bytes:
+    """返回编码好的 SSML；短文本（提示音、确认语等）经常重复，走缓存"""
+    # 长文本很少重复，不进缓存，避免缓存占用过多内存
+    if len(text) > SSML_CACHE_MAX_TEXT_LEN:
+        return _build_ssml_bytes(text, voice_name, rate, pitch, style)
+    return _cached_ssml_bytes(text, voice_name, rate, pitch, style)
+
+
+# ================== 重试策略 ==================
+def is_retryable_error(exc: BaseException) -> bool:
+    """
+    网络类异常（SSL 中断、连接失败、超时等）以及上游临时性状态码才重试，
+    避免逻辑错误被无限重试。
+    """
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code in RETRY_STATUS_CODES
+    return isinstance(exc, (
+        httpx.NetworkError,
+        httpx.TimeoutException,
+        httpx.RemoteProtocolError,
+    ))
 
 
 # ================== 调 endpoint 拿 token ==================
 @retry(
-    retry=retry_if_exception_type((
-        requests.exceptions.SSLError,
-        requests.exceptions.ConnectionError,
-        requests.exceptions.Timeout,
-    )),
+    retry=retry_if_exception(is_retryable_error),
     stop=stop_after_attempt(3),
-    wait=wait_exponential(multiplier=1, min=1, max=5),
+    wait=wait_random_exponential(multiplier=1, max=5),
     reraise=True,
 )
-def get_endpoint(proxies=None):
+async def get_endpoint():
     """
-    获取 endpoint + token，带网络层重试。
+    获取 endpoint + token，网络类异常和 429/5xx 时重试（见 is_retryable_error）。
     """
-    signature = sign(ENDPOINT_URL)
-    headers = {
-        "Accept-Language": "zh-Hans",
-        "X-ClientVersion": CLIENT_VERSION,
-        "X-UserId": USER_ID,
-        "X-HomeGeographicRegion": HOME_GEOGRAPHIC_REGION,
-        "X-ClientTraceId": CLIENT_TRACE_ID,
-        "X-MT-Signature": signature,
-        "User-Agent": USER_AGENT,
-        "Content-Type": "application/json; charset=utf-8",
-        "Content-Length": "0",
-        "Accept-Encoding": "gzip",
-    }
+    headers = ENDPOINT_HEADERS | {"X-MT-Signature": sign(ENDPOINT_URL)}
 
     session = session_manager.session
-    resp = session.post(
+    resp = await session.post(
         ENDPOINT_URL,
         headers=headers,
-        proxies=proxies or GLOBAL_PROXIES,
-        timeout=10,
+        timeout=10.0,
     )
     resp.raise_for_status()
-    return resp.json()
+    return orjson.loads(resp.content)
+
+
+# ================== token 管理 ==================
+_EXP_RE = re.compile(rb'"exp"\s*:\s*(\d+)')
+
+
+@functools.lru_cache(maxsize=1)
+def decode_token_exp(token: str) -> int:
+    """解析 JWT payload 中的 exp；同一个 token 只解析一次"""
+    jwt = token.split('.')[1]
+    # 补齐 base64 padding
+    padding = '=' * (-len(jwt) % 4)
+    payload = base64.b64decode(jwt + padding)
+    # 只需要 exp，直接扫描，匹配不到时再完整解析
+    m = _EXP_RE.search(payload)
+    if m:
+        return int(m.group(1))
+    return orjson.loads(payload)['exp']
+
+
+async def get_token_state() -> TokenState:
+    """返回可用的 token，临近过期（提前 60 秒）时刷新"""
+    global token_state
+
+    current_time = int(time.time())
+    state = token_state
+    if state is not None and current_time <= state.exp - 60:
+        # 每个请求都会走到这里，只在 DEBUG 级别输出
+        logger.debug("沿用 token，剩余有效期 %d 秒", state.exp - current_time)
+        return state
+    if state is not None and current_time < state.exp and _token_lock.locked():
+        # 已有协程在刷新，旧 token 还没真正过期，直接沿用，不必排队等待
+        return state
+
+    async with _token_lock:
+        # 等锁期间可能已有其他协程刷新完成
+        state = token_state
+        current_time = int(time.time())
+        if state is None or current_time > state.exp - 60:
+            endpoint = await get_endpoint()
+            state = TokenState(
+                region=endpoint["r"],
+                exp=decode_token_exp(endpoint["t"]),
+                tts_url=f"https://{endpoint['r']}.tts.speech.microsoft.com/cognitiveservices/v1",
+                headers={
+                    "Authorization": endpoint["t"],
+                    "Content-Type": "application/ssml+xml",
+                    "X-Microsoft-OutputFormat": DEFAULT_OUTPUT_FORMAT,
+                },
+            )
+            token_state = state
+            logger.info("刷新 token，剩余有效期 %d 秒", state.exp - current_time)
+    return state
 
 
 # ================== 主 TTS 调用 ==================
-@retry(
-    retry=retry_if_exception_type((
-        requests.exceptions.SSLError,
-        requests.exceptions.ConnectionError,
-        requests.exceptions.Timeout,
-    )),
-    stop=stop_after_attempt(3),
-    wait=wait_exponential(multiplier=1, min=2, max=5),
-    reraise=True,
-)
-def get_voice(
+def build_tts_request(
     text: str,
     voice_name: str = "",
     rate: str = "",
     pitch: str = "",
     output_format: str = "",
     style: str = "",
-    proxies=None,
-) -> bytes:
-    """
-    调用 TTS，带网络层重试。
-    只对网络类异常重试，避免逻辑错误被无限重试。
-    """
-    global endpoint, expired_at
-
-    current_time = int(time.time())
-    # token 过期检查（提前 60 秒刷新）
-    if not expired_at or current_time > expired_at - 60:
-        endpoint = get_endpoint(proxies)
-        jwt = endpoint['t'].split('.')[1]
-        # 补齐 base64 padding
-        padding = '=' * (-len(jwt) % 4)
-        decoded_jwt = json.loads(base64.b64decode(jwt + padding).decode('utf-8'))
-        expired_at = decoded_jwt['exp']
-        seconds_left = expired_at - current_time
-        # logger.info(f"刷新 token，剩余有效期 {seconds_left} 秒")
-    else:
-        seconds_left = expired_at - current_time
-        # logger.info(f"沿用 token，剩余有效期 {seconds_left} 秒")
-
+) -> Tuple[bytes, str]:
+    """补全默认参数，返回 (SSML, 输出格式)"""
     voice_name = voice_name or DEFAULT_VOICE_NAME
     rate = rate or DEFAULT_RATE
     pitch = pitch or DEFAULT_PITCH
     output_format = output_format or DEFAULT_OUTPUT_FORMAT
     style = style or DEFAULT_STYLE
+    return get_ssml(text, voice_name, rate, pitch, style), output_format
 
-    url = f"https://{endpoint['r']}.tts.speech.microsoft.com/cognitiveservices/v1"
-    headers = {
-        "Authorization": endpoint["t"],
-        "Content-Type": "application/ssml+xml",
-        "X-Microsoft-OutputFormat": output_format,
-    }
 
-    ssml = get_ssml(text, voice_name, rate, pitch, style)
+def audio_cache_key(ssml: bytes, output_format: str) -> bytes:
+    return hashlib.sha256(ssml + b"\0" + output_format.encode("utf-8")).digest()
+
+
+def get_media_type(output_format: str) -> str:
+    """根据 output_format 简单判断 Content-Type"""
+    if "mp3" in output_format:
+        return "audio/mpeg"
+    if "ogg" in output_format:
+        return "audio/ogg"
+    if "wav" in output_format:
+        return "audio/wav"
+    return "application/octet-stream"
+
+
+@retry(
+    retry=retry_if_exception(is_retryable_error),
+    stop=stop_after_attempt(3),
+    wait=wait_random_exponential(multiplier=1, max=5),
+    reraise=True,
+)
+async def get_voice(ssml: bytes, output_format: str) -> httpx.Response:
+    """
+    调用 TTS，带重试。
+    只对网络类异常和上游临时性状态码（429/5xx）重试（见 is_retryable_error），
+    避免逻辑错误被无限重试。
+    返回尚未读取 body 的流式响应，调用方负责读取并关闭（见 iter_audio）。
+    """
+    token = await get_token_state()
+
+    if output_format == DEFAULT_OUTPUT_FORMAT:
+        headers = token.headers
+    else:
+        headers = {**token.headers, "X-Microsoft-OutputFormat": output_format}
 
     session = session_manager.session
-    resp = session.post(
-        url,
+    request = session.build_request(
+        "POST",
+        token.tts_url,
         headers=headers,
-        data=ssml.encode("utf-8"),
-        proxies=proxies or GLOBAL_PROXIES,
-        timeout=30,
+        content=ssml,
+        timeout=30.0,
     )
-    resp.raise_for_status()
-    return resp.content
+    resp = await session.send(request, stream=True)
+    try:
+        resp.raise_for_status()
+    except httpx.HTTPStatusError:
+        await resp.aclose()
+        raise
+    return resp
 
 
-# ================== 语音列表 ==================
-def get_voice_list():
-    """获取可用的语音列表（带简单缓存）"""
-    global voice_list_cache
+async def iter_audio(
+    resp: httpx.Response,
+    cache_key: Optional[bytes] = None,
+    chunk_size: int = 4096,
+):
+    """
+    边从上游下载边转发给客户端，结束或客户端断开时关闭上游响应。
+    传入 cache_key 时同时写入临时文件，完整下载后再放进磁盘缓存。
+    """
+    spool = tempfile.TemporaryFile() if cache_key is not None else None
+    completed = False
+    try:
+        async for chunk in resp.aiter_bytes(chunk_size):
+            if spool is not None:
+                spool.write(chunk)
+            yield chunk
+        completed = True
+    finally:
+        await resp.aclose()
+        if spool is not None:
+            try:
+                if completed:
+                    spool.seek(0)
+                    await asyncio.to_thread(audio_cache.set, cache_key, spool, read=True)
+            except Exception:
+                logger.warning("写入音频缓存失败", exc_info=True)
+            finally:
+                spool.close()
+
+
+async def get_voice_bytes(ssml: bytes, output_format: str) -> bytes:
+    """合成并返回完整音频，优先走磁盘缓存（批量接口使用）"""
+    cache_key = audio_cache_key(ssml, output_format)
+    cached = await asyncio.to_thread(audio_cache.get, cache_key)
+    if cached is not None:
+        return cached
+
+    async with _batch_semaphore:
+        resp = await get_voice(ssml, output_format)
+        try:
+            content = await resp.aread()
+        finally:
+            await resp.aclose()
+    try:
+        await asyncio.to_thread(audio_cache.set, cache_key, content)
+    except Exception:
+        logger.warning("写入音频缓存失败", exc_info=True)
+    return content
 
-    if voice_list_cache is not None:
-        return voice_list_cache
 
-    headers = {
-        "User-Agent": (
-            "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-            "AppleWebKit/537.36 (KHTML, like Gecko) "
-            "Chrome/107.0.0.0 Safari/537.36 Edg/107.0.1418.26"
-        ),
-        "X-Ms-Useragent": "SpeechStudio/2021.05.001",
-        "Content-Type": "application/json",
-        "Origin": "https://azure.microsoft.com",
-        "Referer": "https://azure.microsoft.com",
-    }
+async def iter_cached_audio(fp: BinaryIO, chunk_size: int = 64 * 1024):
+    """分块读取磁盘缓存中的音频文件，读完或客户端断开时关闭文件"""
+    try:
+        while chunk := await asyncio.to_thread(fp.read, chunk_size):
+            yield chunk
+    finally:
+        fp.close()
+
+
+# ================== 语音列表 ==================
+async def _fetch_voice_list() -> Optional[VoiceCache]:
+    """从上游拉取语音列表并更新缓存，拉取失败时沿用旧数据"""
+    global voice_list_cache
 
     session = session_manager.session
     try:
-        resp = session.get(
+        resp = await session.get(
             VOICES_LIST_URL,
-            headers=headers,
-            timeout=10,
-            proxies=GLOBAL_PROXIES,
+            headers=VOICES_HEADERS,
+            timeout=10.0,
         )
         resp.raise_for_status()
-        result = resp.json()
-        voice_list_cache = result
-        return result
-    except requests.exceptions.RequestException as e:
-        logger.error(f"获取语音列表失败: {e}", exc_info=True)
-        return None
+        # 解析一遍校验内容并去掉多余空白，只保留序列化后的字节
+        body = orjson.dumps(orjson.loads(resp.content))
+        digest = hashlib.blake2b(resp.content, digest_size=16).hexdigest()
+        voice_list_cache = VoiceCache(
+            etag=f'"{digest}"',
+            gzip_etag=f'"{digest}-gzip"',
+            body=body,
+            # mtime 固定为 0，保证相同内容压缩结果逐字节一致，强 ETag 才成立
+            gzip_body=gzip.compress(body, mtime=0),
+        )
+        return voice_list_cache
+    except (httpx.HTTPError, orjson.JSONDecodeError) as e:
+        logger.error("获取语音列表失败: %s", e, exc_info=True)
+        return voice_list_cache
+
+
+async def refresh_voice_list() -> Optional[VoiceCache]:
+    """刷新语音列表；已有拉取在进行时直接等待它的结果，不再重复请求上游"""
+    global _voice_refresh_task
+
+    task = _voice_refresh_task
+    if task is None or task.done():
+        task = asyncio.get_running_loop().create_task(_fetch_voice_list())
+        _voice_refresh_task = task
+    # shield：某个等待方被取消（如客户端断开）时不影响其他等待方共享的拉取
+    return await asyncio.shield(task)
+
+
+async def get_voice_list() -> Optional[VoiceCache]:
+    """获取语音列表；缓存由后台任务定时刷新，只有尚未拉取过时才在请求中拉取"""
+    cache = voice_list_cache
+    if cache is not None:
+        return cache
+    return await refresh_voice_list()
+
+
+async def _refresh_voices_loop() -> None:
+    """后台定时刷新语音列表，让 /voices 请求不必等待上游"""
+    while True:
+        try:
+            await refresh_voice_list()
+        except Exception:
+            logger.exception("后台刷新语音列表失败")
+        await asyncio.sleep(VOICE_LIST_TTL_SEC)
+
+
+def etag_matches(if_none_match: str, *etags: str) -> bool:
+    """If-None-Match 使用弱比较，忽略 W/ 前缀；命中任意一个 etag 即可"""
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*" or tag.removeprefix("W/") in etags:
+            return True
+    return False
+
+
+def accepts_gzip(accept_encoding: Optional[str]) -> bool:
+    """按 Accept-Encoding 的 q 值判断客户端是否接受 gzip（q=0 表示拒绝）"""
+    if not accept_encoding:
+        return False
+    wildcard: Optional[bool] = None
+    for item in accept_encoding.split(","):
+        coding, _, params = item.partition(";")
+        coding = coding.strip().lower()
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value.strip())
+                except ValueError:
+                    q = 0.0
+        if coding == "gzip":
+            return q > 0
+        if coding == "*":
+            wildcard = q > 0
+    return bool(wildcard)
+
+
+# ================== 请求/响应模型 ==================
+class TtsItem(BaseModel):
+    text: str = Field(..., description="要合成的文本")
+    voice_name: str = Field(DEFAULT_VOICE_NAME, description="语音名称")
+    rate: str = Field(DEFAULT_RATE, description="语速百分比，如 -20, 0, 20")
+    pitch: str = Field(DEFAULT_PITCH, description="音调百分比，如 -20, 0, 20")
+    output_format: str = Field(DEFAULT_OUTPUT_FORMAT, description="输出格式")
+    style: str = Field(DEFAULT_STYLE, description="说话风格")
+
+    @field_validator("text")
+    @classmethod
+    def text_not_blank(cls, v: str) -> str:
+        if not v.strip():
+            raise ValueError("text 不能为空")
+        return v
+
+
+class BatchReq(BaseModel):
+    items: List[TtsItem] = Field(..., min_length=1, max_length=BATCH_MAX_ITEMS)
 
 
 # ================== FastAPI 路由 ==================
 @app.get("/tts")
-def tts_api(
+async def tts_api(
     text: str = Query(..., description="要合成的文本"),
     voice_name: str = Query(DEFAULT_VOICE_NAME, description="语音名称"),
     rate: str = Query(DEFAULT_RATE, description="语速百分比，如 -20, 0, 20"),
     pitch: str = Query(DEFAULT_PITCH, description="音调百分比，如 -20, 0, 20"),
     output_format: str = Query(DEFAULT_OUTPUT_FORMAT, description="输出格式"),
     style: str = Query(DEFAULT_STYLE, description="说话风格"),
+    no_cache: bool = Query(False, description="跳过音频缓存，强制重新合成"),
 ):
     """
     使用 GET 请求进行 TTS：
@@ -311,46 +719,94 @@ def tts_api(
     if not text.strip():
         raise HTTPException(status_code=400, detail="text 不能为空")
 
+    ssml, output_format = build_tts_request(text, voice_name, rate, pitch, output_format, style)
+    media_type = get_media_type(output_format)
+    cache_key = audio_cache_key(ssml, output_format)
+
+    if not no_cache:
+        cached = await asyncio.to_thread(audio_cache.get, cache_key, read=True)
+        # 小文件内联存在数据库里，返回 bytes；大文件返回打开的文件句柄，边读边发
+        if isinstance(cached, bytes):
+            return Response(content=cached, media_type=media_type)
+        if cached is not None:
+            return StreamingResponse(iter_cached_audio(cached), media_type=media_type)
+
     try:
-        audio_bytes = get_voice(
-            text=text,
-            voice_name=voice_name,
-            rate=rate,
-            pitch=pitch,
-            output_format=output_format,
-            style=style,
-        )
-    except requests.HTTPError as e:
-        # 这里是 HTTP 状态码错误（4xx/5xx），不再重试
-        logger.exception("TTS 请求失败（HTTPError）")
+        resp = await get_voice(ssml, output_format)
+    except httpx.HTTPStatusError as e:
+        # 这里是 HTTP 状态码错误（4xx/5xx），临时性错误已重试过
+        logger.exception("TTS 请求失败（HTTPStatusError）")
         raise HTTPException(status_code=502, detail=f"TTS 服务错误: {e}")
-    except requests.exceptions.SSLError as e:
-        logger.exception("TTS 请求失败（SSLError，多次重试后仍失败）")
-        raise HTTPException(status_code=502, detail="TTS 网络错误，请稍后重试")
-    except requests.exceptions.RequestException as e:
+    except httpx.RequestError as e:
         logger.exception("TTS 请求失败（网络相关异常）")
         raise HTTPException(status_code=502, detail="TTS 网络错误，请稍后重试")
     except Exception as e:
         logger.exception("TTS 未知错误")
         raise HTTPException(status_code=500, detail=f"服务器内部错误: {e}")
 
-    # 根据 output_format 简单判断 Content-Type
-    if "mp3" in output_format:
-        media_type = "audio/mpeg"
-    elif "ogg" in output_format:
-        media_type = "audio/ogg"
-    elif "wav" in output_format:
-        media_type = "audio/wav"
-    else:
-        media_type = "application/octet-stream"
+    return StreamingResponse(iter_audio(resp, cache_key), media_type=media_type)
+
 
-    return Response(content=audio_bytes, media_type=media_type)
+@app.post("/tts/batch")
+async def tts_batch(req: BatchReq):
+    """
+    批量 TTS，各条目并发合成，结果按 index 对应请求顺序：
+    {"results": [{"index": 0, "content_type": "audio/mpeg", "audio_b64": "..."}]}
+    单条合成失败不影响其它条目，失败项返回 {"index": i, "error": "..."}；
+    text 为空等参数错误在校验阶段直接返回 422。
+    """
+    async def synthesize(item: TtsItem) -> Tuple[bytes, str]:
+        ssml, output_format = build_tts_request(
+            item.text, item.voice_name, item.rate, item.pitch, item.output_format, item.style,
+        )
+        return await get_voice_bytes(ssml, output_format), get_media_type(output_format)
+
+    outcomes = await asyncio.gather(
+        *(synthesize(item) for item in req.items),
+        return_exceptions=True,
+    )
+
+    results = []
+    for index, outcome in enumerate(outcomes):
+        if isinstance(outcome, httpx.HTTPStatusError):
+            logger.error("批量 TTS 第 %d 条失败（HTTPStatusError）: %s", index, outcome)
+            results.append({"index": index, "error": f"TTS 服务错误: {outcome}"})
+        elif isinstance(outcome, httpx.RequestError):
+            logger.error("批量 TTS 第 %d 条失败（网络相关异常）: %s", index, outcome)
+            results.append({"index": index, "error": "TTS 网络错误，请稍后重试"})
+        elif isinstance(outcome, BaseException):
+            logger.error("批量 TTS 第 %d 条未知错误", index, exc_info=outcome)
+            results.append({"index": index, "error": f"服务器内部错误: {outcome}"})
+        else:
+            audio, media_type = outcome
+            results.append({
+                "index": index,
+                "content_type": media_type,
+                "audio_b64": base64.b64encode(audio).decode(),
+            })
+    return {"results": results}
 
 
 @app.get("/voices")
-def voices_api():
-    """获取语音列表"""
-    voices = get_voice_list()
+async def voices_api(
+    if_none_match: Optional[str] = Header(None),
+    accept_encoding: Optional[str] = Header(None),
+):
+    """获取语音列表（支持 ETag 协商缓存和 gzip）"""
+    voices = await get_voice_list()
     if voices is None:
         raise HTTPException(status_code=502, detail="获取语音列表失败")
-    return voices
+
+    use_gzip = accepts_gzip(accept_encoding)
+    headers = {
+        "ETag": voices.gzip_etag if use_gzip else voices.etag,
+        "Cache-Control": f"public, max-age={VOICE_LIST_TTL_SEC}",
+        "Vary": "Accept-Encoding",
+    }
+    if if_none_match and etag_matches(if_none_match, voices.etag, voices.gzip_etag):
+        return Response(status_code=304, headers=headers)
+
+    if use_gzip:
+        headers["Content-Encoding"] = "gzip"
+        return Response(content=voices.gzip_body, media_type="application/json", headers=headers)
+    return Response(content=voices.body, media_type="application/json", headers=headers)